@@ -0,0 +1,375 @@
+import os
+import time
+import threading
+import numpy as np
+
+# 偵測事件紀錄 (append-only, 以欄為單位批次寫入)
+#
+# 檔案配置 (以 base 為前綴):
+#   base.evt  資料檔，每個批次依序寫入各欄位的連續陣列
+#   base.idx  索引檔，每個批次一筆固定長度紀錄 (位移、長度、幀數、框數、時間範圍)
+#   base.cam  攝影機名稱表，每行一個名稱，行號即 camera_id
+#
+# 每幀的 record() 只把數值附加到 Python list，真正的轉換與寫檔在 flush() 時
+# 一次完成，因此全速記錄多台攝影機時每幀的額外成本很小。
+
+# 幀欄位 (每個偵測結果一列)
+FRAME_COLUMNS = [
+    ('timestamp', '<f8'),   # time.time()
+    ('camera', '<u2'),      # base.cam 中的行號
+    ('mode', 'u1'),         # 偵測模式 (0: HOG, 1: 人臉)
+    ('exposure', 'i1'),     # 曝光等級 (-2 到 2)
+    ('process_ms', '<f4'),  # 處理時間 (毫秒)
+    ('box_start', '<u4'),   # 該幀第一個框在批次框欄位中的位置
+    ('box_count', '<u2'),   # 該幀的框數
+]
+
+# 框欄位 (每個偵測框一列)
+BOX_COLUMNS = [
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('w', '<i2'),
+    ('h', '<i2'),
+    ('score', '<f4'),       # 無分數的偵測 (人臉、手動) 記為 NaN
+    ('kind', 'u1'),         # BOX_KINDS 中的索引
+]
+
+BOX_KINDS = ['person', 'face', 'manual']
+
+COLUMN_DTYPES = dict(FRAME_COLUMNS + BOX_COLUMNS)
+
+# 索引紀錄: 批次在資料檔的位移與長度、幀數、框數、最早與最晚時間戳記
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('nbytes', '<u8'),
+    ('n_frames', '<u4'),
+    ('n_boxes', '<u4'),
+    ('t_min', '<f8'),
+    ('t_max', '<f8'),
+])
+
+DEFAULT_BATCH_SIZE = 512      # 累積多少幀後寫入
+DEFAULT_FLUSH_INTERVAL = 5.0  # 最多間隔幾秒寫入一次
+
+
+class DetectionEventLog:
+    def __init__(self, base_path, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.base_path = base_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._data_path = base_path + '.evt'
+        self._index_path = base_path + '.idx'
+        self._camera_path = base_path + '.cam'
+
+        directory = os.path.dirname(os.path.abspath(base_path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._buffer_lock = threading.Lock()  # 保護記憶體緩衝區
+        self._write_lock = threading.Lock()   # 保證批次依序寫入
+        self._closed = False
+        self._reset_buffer()
+        self._last_flush = time.time()
+
+        self._cameras = self._load_cameras()
+        self._camera_ids = {name: i for i, name in enumerate(self._cameras)}
+        self._index = self._load_index()
+        self._data_file = open(self._data_path, 'ab')
+        self._index_file = open(self._index_path, 'ab')
+
+    # 載入攝影機名稱表
+    def _load_cameras(self):
+        if not os.path.exists(self._camera_path):
+            return []
+        with open(self._camera_path, 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
+
+    # 載入索引，並截掉上次異常結束時未完整寫入的部分
+    def _load_index(self):
+        index = np.zeros(0, dtype=INDEX_DTYPE)
+        if os.path.exists(self._index_path):
+            size = os.path.getsize(self._index_path)
+            complete = size - size % INDEX_DTYPE.itemsize
+            if complete != size:
+                with open(self._index_path, 'r+b') as f:
+                    f.truncate(complete)
+            index = np.fromfile(self._index_path, dtype=INDEX_DTYPE)
+
+        # 資料檔比索引短時，丟棄指向不存在資料的索引紀錄
+        data_size = os.path.getsize(self._data_path) if os.path.exists(self._data_path) else 0
+        valid = len(index)
+        while valid > 0 and int(index['offset'][valid - 1] + index['nbytes'][valid - 1]) > data_size:
+            valid -= 1
+        if valid != len(index):
+            index = index[:valid]
+            with open(self._index_path, 'r+b') as f:
+                f.truncate(valid * INDEX_DTYPE.itemsize)
+
+        data_end = int(index['offset'][-1] + index['nbytes'][-1]) if len(index) else 0
+        if data_size > data_end:
+            with open(self._data_path, 'r+b') as f:
+                f.truncate(data_end)
+        return index
+
+    # 換上空的緩衝區，回傳原本的緩衝區
+    def _reset_buffer(self):
+        old = getattr(self, '_frames', None), getattr(self, '_boxes', None)
+        self._frames = {name: [] for name, _ in FRAME_COLUMNS}
+        self._boxes = {name: [] for name, _ in BOX_COLUMNS}
+        return old
+
+    # 寫入失敗時把取出的批次放回緩衝區，排在之後新記錄的資料前面
+    def _restore_buffer(self, frames, boxes):
+        with self._buffer_lock:
+            box_shift = len(boxes['x'])
+            newer_frames = self._frames
+            newer_boxes = self._boxes
+            for name, _ in FRAME_COLUMNS:
+                if name == 'box_start':
+                    frames[name].extend(start + box_shift for start in newer_frames[name])
+                else:
+                    frames[name].extend(newer_frames[name])
+            for name, _ in BOX_COLUMNS:
+                boxes[name].extend(newer_boxes[name])
+            self._frames = frames
+            self._boxes = boxes
+
+    # 檢查整數是否在欄位型別的範圍內
+    @staticmethod
+    def _check_range(name, value, dtype):
+        value = int(value)
+        info = np.iinfo(dtype)
+        if not info.min <= value <= info.max:
+            raise ValueError(f"{name} {value} out of range [{info.min}, {info.max}]")
+        return value
+
+    def _camera_id(self, camera):
+        camera_id = self._camera_ids.get(camera)
+        if camera_id is None:
+            # 名稱表以行號對應 camera_id，不接受空名稱或含換行的名稱
+            if not camera or '\n' in camera or '\r' in camera:
+                raise ValueError(f"Invalid camera name: {camera!r}")
+            camera_id = self._check_range('camera id', len(self._cameras), COLUMN_DTYPES['camera'])
+            with open(self._camera_path, 'a', encoding='utf-8') as f:
+                f.write(camera + '\n')
+            self._cameras.append(camera)
+            self._camera_ids[camera] = camera_id
+        return camera_id
+
+    # 記錄一幀的偵測結果
+    # detections: [(kind, (x, y, w, h)), ...]，scores 與 detections 一一對應 (可省略)
+    def record(self, camera, detections, scores=None, mode=0, exposure=0,
+               process_time=0.0, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if scores is not None and len(scores) != len(detections):
+            raise ValueError(f"Got {len(scores)} scores for {len(detections)} detections")
+
+        # 先檢查並轉換所有數值 (包括是否超出欄位型別範圍)，全部成功後才寫入
+        # 共用緩衝區，避免中途出錯使各欄位長度不一致或在 flush() 時才失敗
+        check = self._check_range
+        box_count = check('box count', len(detections), COLUMN_DTYPES['box_count'])
+        new_boxes = {name: [] for name, _ in BOX_COLUMNS}
+        for i, (kind, (x, y, w, h)) in enumerate(detections):
+            if kind not in BOX_KINDS:
+                raise ValueError(f"Unknown detection kind: {kind!r}")
+            for name, value in (('x', x), ('y', y), ('w', w), ('h', h)):
+                new_boxes[name].append(check(name, value, COLUMN_DTYPES[name]))
+            new_boxes['score'].append(float(scores[i]) if scores is not None else np.nan)
+            new_boxes['kind'].append(BOX_KINDS.index(kind))
+        timestamp = float(timestamp)
+        mode = check('mode', mode, COLUMN_DTYPES['mode'])
+        exposure = check('exposure', exposure, COLUMN_DTYPES['exposure'])
+        process_ms = float(process_time) * 1000.0
+
+        with self._buffer_lock:
+            if self._closed:
+                raise ValueError("record() on closed DetectionEventLog")
+            camera_id = self._camera_id(camera)
+            frames = self._frames
+            boxes = self._boxes
+            frames['timestamp'].append(timestamp)
+            frames['camera'].append(camera_id)
+            frames['mode'].append(mode)
+            frames['exposure'].append(exposure)
+            frames['process_ms'].append(process_ms)
+            frames['box_start'].append(len(boxes['x']))
+            frames['box_count'].append(box_count)
+            for name, values in new_boxes.items():
+                boxes[name].extend(values)
+
+            pending = len(frames['timestamp'])
+
+        if pending >= self.batch_size or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    # 將緩衝區內容以一個批次寫入檔案
+    def flush(self):
+        with self._write_lock:
+            if not self._closed:
+                self._flush_locked()
+
+    # 呼叫前須持有 _write_lock
+    def _flush_locked(self):
+        with self._buffer_lock:
+            frames, boxes = self._reset_buffer()
+            self._last_flush = time.time()
+
+        n_frames = len(frames['timestamp'])
+        if n_frames == 0:
+            return
+
+        try:
+            self._write_batch(frames, boxes)
+        except Exception:
+            self._restore_buffer(frames, boxes)
+            raise
+
+    # 轉換為欄位陣列並寫入資料檔與索引檔
+    def _write_batch(self, frames, boxes):
+        n_frames = len(frames['timestamp'])
+        chunks = [np.asarray(frames[name], dtype=dtype).tobytes()
+                  for name, dtype in FRAME_COLUMNS]
+        chunks += [np.asarray(boxes[name], dtype=dtype).tobytes()
+                   for name, dtype in BOX_COLUMNS]
+        payload = b''.join(chunks)
+
+        # 以資料檔實際結尾為位移，寫入失敗時截回原長度，避免之後的索引錯位
+        offset = self._data_file.tell()
+        index_offset = self._index_file.tell()
+        entry = np.array([(offset, len(payload), n_frames, len(boxes['x']),
+                           min(frames['timestamp']), max(frames['timestamp']))],
+                         dtype=INDEX_DTYPE)
+
+        # 先寫資料再寫索引，索引存在即代表該批次完整
+        try:
+            self._data_file.write(payload)
+            self._data_file.flush()
+            self._index_file.write(entry.tobytes())
+            self._index_file.flush()
+        except Exception:
+            for f, size in ((self._index_file, index_offset), (self._data_file, offset)):
+                try:
+                    f.seek(size)
+                    f.truncate(size)
+                except OSError:
+                    pass
+            raise
+        self._index = np.concatenate([self._index, entry])
+
+    # 寫入剩餘資料並關閉檔案；之後的 record() 會引發 ValueError
+    def close(self):
+        with self._write_lock:
+            if self._closed:
+                return
+            with self._buffer_lock:
+                self._closed = True
+            try:
+                self._flush_locked()
+            finally:
+                self._data_file.close()
+                self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # 解析一個批次為欄位陣列
+    @staticmethod
+    def _decode_batch(payload, n_frames, n_boxes):
+        frames = {}
+        boxes = {}
+        pos = 0
+        for name, dtype in FRAME_COLUMNS:
+            frames[name] = np.frombuffer(payload, dtype=dtype, count=n_frames, offset=pos)
+            pos += frames[name].nbytes
+        for name, dtype in BOX_COLUMNS:
+            boxes[name] = np.frombuffer(payload, dtype=dtype, count=n_boxes, offset=pos)
+            pos += boxes[name].nbytes
+        return frames, boxes
+
+    # 查詢時間範圍 [start, end) 內的紀錄，camera 為 None 時包含所有攝影機
+    # 回傳 (frames, boxes)，兩者皆為欄位名稱對應 numpy 陣列的 dict；
+    # frames['box_start'] 會改為指向回傳的 boxes 陣列
+    def query(self, start=None, end=None, camera=None):
+        self.flush()
+
+        index = self._index
+        selected = np.ones(len(index), dtype=bool)
+        if start is not None:
+            selected &= index['t_max'] >= start
+        if end is not None:
+            selected &= index['t_min'] < end
+
+        camera_id = None
+        if camera is not None:
+            camera_id = self._camera_ids.get(camera)
+            if camera_id is None:
+                selected[:] = False
+
+        frame_parts = {name: [] for name, _ in FRAME_COLUMNS}
+        box_parts = {name: [] for name, _ in BOX_COLUMNS}
+        box_total = 0
+
+        with open(self._data_path, 'rb') as f:
+            for entry in index[selected]:
+                f.seek(int(entry['offset']))
+                payload = f.read(int(entry['nbytes']))
+                frames, boxes = self._decode_batch(payload, int(entry['n_frames']), int(entry['n_boxes']))
+
+                mask = np.ones(len(frames['timestamp']), dtype=bool)
+                if start is not None:
+                    mask &= frames['timestamp'] >= start
+                if end is not None:
+                    mask &= frames['timestamp'] < end
+                if camera_id is not None:
+                    mask &= frames['camera'] == camera_id
+                if not mask.any():
+                    continue
+
+                box_start = frames['box_start'][mask].astype(np.int64)
+                box_count = frames['box_count'][mask].astype(np.int64)
+                box_rows = np.repeat(box_start, box_count) + \
+                    np.arange(box_count.sum()) - np.repeat(np.cumsum(box_count) - box_count, box_count)
+
+                for name, _ in FRAME_COLUMNS:
+                    frame_parts[name].append(frames[name][mask])
+                frame_parts['box_start'][-1] = (np.cumsum(box_count) - box_count + box_total).astype('<u4')
+                for name, _ in BOX_COLUMNS:
+                    box_parts[name].append(boxes[name][box_rows])
+                box_total += len(box_rows)
+
+        frames = {name: np.concatenate(frame_parts[name]) if frame_parts[name] else np.zeros(0, dtype=dtype)
+                  for name, dtype in FRAME_COLUMNS}
+        boxes = {name: np.concatenate(box_parts[name]) if box_parts[name] else np.zeros(0, dtype=dtype)
+                 for name, dtype in BOX_COLUMNS}
+        return frames, boxes
+
+    # 依攝影機彙整時間範圍 [start, end) 內的統計
+    def aggregate(self, start=None, end=None, camera=None):
+        frames, boxes = self.query(start, end, camera)
+
+        box_camera = np.repeat(frames['camera'], frames['box_count'])
+        summary = {}
+        for camera_id in np.unique(frames['camera']):
+            frame_mask = frames['camera'] == camera_id
+            box_mask = box_camera == camera_id
+            box_count = frames['box_count'][frame_mask]
+            process_ms = frames['process_ms'][frame_mask]
+            scores = boxes['score'][box_mask]
+            scores = scores[~np.isnan(scores)]
+
+            summary[self._cameras[camera_id]] = {
+                'frames': int(frame_mask.sum()),
+                'frames_with_detection': int((box_count > 0).sum()),
+                'detections': int(box_count.sum()),
+                'first_timestamp': float(frames['timestamp'][frame_mask].min()),
+                'last_timestamp': float(frames['timestamp'][frame_mask].max()),
+                'mean_process_ms': float(process_ms.mean()),
+                'max_process_ms': float(process_ms.max()),
+                'mean_score': float(scores.mean()) if len(scores) else float('nan'),
+            }
+        return summary
@@ -0,0 +1,161 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from DetectionEventLog import DetectionEventLog, INDEX_DTYPE
+
+# DetectionEventLog 的往返測試: 記錄、重新開啟、查詢、未完整寫入的尾端、多台攝影機
+# 執行方式: python DetectionEventLogTest.py
+
+temp_dir = tempfile.mkdtemp()
+base = os.path.join(temp_dir, "logs", "events")
+
+
+def check(condition, message):
+    if not condition:
+        print(f"FAIL: {message}")
+        sys.exit(1)
+    print(f"OK:   {message}")
+
+
+try:
+    # 多台攝影機、跨多個批次記錄
+    log = DetectionEventLog(base, batch_size=4)
+    for i in range(10):
+        camera = "camA" if i % 2 else "camB"
+        detections = [('person', (i, 2, 3, 4)), ('face', (5, 6, 7, 8))][:i % 3]
+        scores = [0.5, np.nan][:i % 3]
+        log.record(camera, detections, scores, mode=i % 2, exposure=i % 5 - 2,
+                   process_time=0.001 * i, timestamp=100.0 + i)
+    log.close()
+    log.close()
+    check(os.path.getsize(base + ".idx") == 3 * INDEX_DTYPE.itemsize, "three batches written")
+
+    # 重新開啟後查詢時間範圍與攝影機
+    log = DetectionEventLog(base)
+    frames, boxes = log.query(102, 108, "camA")
+    check(list(frames['timestamp']) == [103.0, 105.0, 107.0], "query by time range and camera")
+    check(list(frames['box_count']) == [0, 2, 1], "box counts per frame")
+    check(list(frames['box_start']) == [0, 0, 2], "box_start points into returned boxes")
+    check(list(boxes['x']) == [5, 5, 7], "box columns follow selected frames")
+    check(list(boxes['kind']) == [0, 1, 0], "box kinds")
+
+    summary = log.aggregate()
+    check(sorted(summary) == ["camA", "camB"], "aggregate covers both cameras")
+    check(summary["camA"]['frames'] == 5 and summary["camA"]['detections'] == 4, "camA totals")
+    check(summary["camB"]['detections'] == 5, "camB totals")
+    check(abs(summary["camB"]['mean_score'] - 0.5) < 1e-6, "NaN scores excluded from mean")
+
+    # 錯誤的輸入不應破壞緩衝區
+    for bad in ([('car', (1, 2, 3, 4))], [0.9]), ([('person', (1, 2, 3, 4))], []):
+        try:
+            log.record("camA", bad[0], bad[1], timestamp=200.0)
+            check(False, "invalid record rejected")
+        except ValueError:
+            pass
+    for name in ("", "cam\nX"):
+        try:
+            log.record(name, [], timestamp=200.0)
+            check(False, "invalid camera name rejected")
+        except ValueError:
+            pass
+    log.record("camC", [('manual', (1, 1, 1, 1))], timestamp=201.0)
+    log.close()
+
+    log = DetectionEventLog(base)
+    check(log.aggregate(200)["camC"]['detections'] == 1, "log readable after rejected records")
+    log.close()
+
+    # 未完整寫入的尾端: 資料檔多出的位元組與不完整的索引紀錄都應被截掉
+    data_size = os.path.getsize(base + ".evt")
+    index_size = os.path.getsize(base + ".idx")
+    with open(base + ".evt", "ab") as f:
+        f.write(b"partial batch")
+    with open(base + ".idx", "ab") as f:
+        f.write(b"\x01\x02\x03")
+    log = DetectionEventLog(base)
+    check(os.path.getsize(base + ".evt") == data_size, "torn data tail truncated")
+    check(os.path.getsize(base + ".idx") == index_size, "torn index tail truncated")
+    check(len(log.query()[0]['timestamp']) == 11, "all complete frames still readable")
+    log.close()
+
+    # 資料檔比索引短: 丟棄指向遺失資料的索引紀錄
+    with open(base + ".evt", "r+b") as f:
+        f.truncate(data_size - 1)
+    log = DetectionEventLog(base)
+    check(len(log.query()[0]['timestamp']) == 10, "index entries past data end dropped")
+    log.record("camA", [('person', (9, 9, 9, 9))], [0.8], timestamp=300.0)
+    log.close()
+
+    log = DetectionEventLog(base)
+    frames, boxes = log.query(300)
+    check(list(boxes['x']) == [9], "appending after recovery stays aligned")
+    log.close()
+
+    # 超出欄位型別範圍的數值應在 record() 時被拒絕，不影響已記錄的幀
+    base = os.path.join(temp_dir, "range", "events")
+    log = DetectionEventLog(base)
+    log.record("camA", [('person', (1, 2, 3, 4))], [0.5], timestamp=1.0)
+    bad_records = [
+        dict(detections=[('person', (40000, 2, 3, 4))]),
+        dict(detections=[('person', (1, 2, 3, 4))], mode=300),
+        dict(detections=[], exposure=200),
+        dict(detections=[('face', (0, 0, 1, 1))] * 65536),
+    ]
+    for bad in bad_records:
+        try:
+            log.record("camA", timestamp=2.0, **bad)
+            check(False, "out-of-range record rejected")
+        except ValueError:
+            pass
+    log.close()
+    log = DetectionEventLog(base)
+    frames, boxes = log.query()
+    check(list(frames['timestamp']) == [1.0] and list(boxes['x']) == [1], "valid frame survives out-of-range records")
+
+    # 寫入失敗時批次應留在緩衝區，下次 flush() 依原順序寫入
+    class FailingFile:
+        def __init__(self, f):
+            self.f = f
+            self.fail = True
+
+        def write(self, payload):
+            if self.fail:
+                self.fail = False
+                self.f.write(payload[:7])
+                self.f.flush()
+                raise OSError("disk full")
+            return self.f.write(payload)
+
+        def __getattr__(self, name):
+            return getattr(self.f, name)
+
+    log._data_file = FailingFile(log._data_file)
+    log.record("camA", [('person', (5, 5, 5, 5))], [0.5], timestamp=2.0)
+    try:
+        log.flush()
+        check(False, "failed write raises")
+    except OSError:
+        pass
+    log.record("camA", [('face', (6, 6, 6, 6))], timestamp=3.0)
+    log.close()
+    log = DetectionEventLog(base)
+    frames, boxes = log.query()
+    check(list(frames['timestamp']) == [1.0, 2.0, 3.0], "batch kept after failed write")
+    check(list(frames['box_start']) == [0, 1, 2] and list(boxes['x']) == [1, 5, 6], "restored batch stays aligned")
+
+    # 關閉後的 record() 應引發明確的錯誤，flush() 與 close() 不做任何事
+    log.close()
+    try:
+        log.record("camA", [], timestamp=4.0)
+        check(False, "record after close raises")
+    except ValueError:
+        pass
+    log.flush()
+    log.close()
+    check(len(log.query()[0]['timestamp']) == 3, "log still queryable after close")
+
+    print("All tests passed")
+finally:
+    shutil.rmtree(temp_dir)
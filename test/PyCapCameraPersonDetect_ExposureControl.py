@@ -6,7 +6,9 @@ import datetime
 import time
 import sys
 import threading
+import atexit
 import requests  # 用於發送HTTP請求控制曝光
+from DetectionEventLog import DetectionEventLog
 
 # 設定 ESP32-CAM 的 IP 位址
 url = "http://172.16.18.123/stream"
@@ -58,6 +60,12 @@ face_scale_factor = 1.1
 face_min_neighbors = 3
 face_min_size = (30, 30)
 
+# 偵測事件紀錄 (批次寫入 detection_logs/，結束時自動寫入剩餘資料)
+event_log = DetectionEventLog(os.path.join("detection_logs", "events"))
+stop_event = threading.Event()  # 通知處理線程結束
+processing_thread = None
+summary_window = 3600  # 按 's' 時統計最近幾秒的紀錄
+
 # FPS計算相關變數
 frame_times = []
 fps_update_interval = 0.5  # 每0.5秒更新一次FPS
@@ -154,10 +162,12 @@ def update_fps(is_processing=False):
 def process_image_thread():
     global display_img, processed_img, person_count, last_detection_time, processing_frame
     
-    while True:
+    while not stop_event.is_set():
         if processed_img is not None and not processing_frame and detection_active:
             processing_frame = True
             process_start_time = time.time()
+            # 每幀只讀取一次，避免主線程在處理途中切換造成前後不一致
+            frame_detection_enabled = detection_enabled
             
             try:
                 # 複製一份用於處理
@@ -167,7 +177,7 @@ def process_image_thread():
                 display_copy = img_to_process.copy()
                 
                 # 如果辨識功能已啟用，進行人體檢測
-                if detection_enabled:
+                if frame_detection_enabled:
                     # 創建灰階圖像用於偵測
                     gray = cv.cvtColor(img_to_process, cv.COLOR_BGR2GRAY)
                     
@@ -178,8 +188,9 @@ def process_image_thread():
                     # 應用額外的圖像增強
                     enhanced_img = cv.convertScaleAbs(img_to_process, alpha=1.2, beta=10)  # 增加亮度和對比度
                     
-                    # 存儲所有偵測到的人體框
+                    # 存儲所有偵測到的人體框及對應分數 (無分數者為 NaN)
                     all_detections = []
+                    detection_scores = []
                     
                     # 根據模式選擇偵測方法
                     if detection_mode == 0:  # HOG 偵測
@@ -203,6 +214,7 @@ def process_image_thread():
                                         weight_value = weights[i] if isinstance(weights[i], float) else weights[i][0]
                                         if weight_value > min_weight_threshold:
                                             all_detections.append(('person', rect))
+                                            detection_scores.append(weight_value)
                             
                             # 如果沒有檢測到，使用更寬鬆的參數再試一次
                             if len(all_detections) == 0:
@@ -219,6 +231,7 @@ def process_image_thread():
                                             weight_value = weights[i] if isinstance(weights[i], float) else weights[i][0]
                                             if weight_value > min_weight_threshold * 0.7:  # 使用更低的閾值
                                                 all_detections.append(('person', rect))
+                                                detection_scores.append(weight_value)
                         except Exception as e:
                             print(f"HOG detection error: {str(e)}")
                     
@@ -245,6 +258,7 @@ def process_image_thread():
                                             all_detections.append(('face', (x, y, w, expanded_h)))
                                         else:
                                             all_detections.append(('face', face))
+                                        detection_scores.append(np.nan)
                             except Exception as e:
                                 print(f"Face detection error: {str(e)}")
                     
@@ -266,6 +280,7 @@ def process_image_thread():
                             # 如果亮度超過一定閾值，認為有人
                             if avg_brightness > 30:  # 亮度閾值可以調整
                                 all_detections.append(('manual', (circle_x-circle_w//2, circle_y-circle_h//2, circle_w, circle_h)))
+                                detection_scores.append(np.nan)
                     
                     # 在影像上標示人體
                     current_time = time.time()
@@ -327,6 +342,12 @@ def process_image_thread():
                 cv.putText(display_copy, f"Process Time: {process_time*1000:.1f} ms", 
                           (10, 200), cv.FONT_HERSHEY_SIMPLEX, 0.6, FPS_COLOR, 2)
                 
+                # 記錄本幀偵測結果 (只附加到記憶體緩衝區，批次寫檔)
+                if frame_detection_enabled:
+                    event_log.record(url, all_detections, detection_scores,
+                                     mode=detection_mode, exposure=current_exposure,
+                                     process_time=process_time, timestamp=process_start_time)
+                
                 # 更新顯示圖像
                 display_img = display_copy
                 
@@ -342,6 +363,15 @@ def process_image_thread():
         # 短暫休眠以避免CPU佔用過高
         time.sleep(0.01)
 
+# 程式結束時 (包括 Ctrl+C 與例外) 先停止處理線程，再寫入剩餘的偵測紀錄
+def shutdown():
+    stop_event.set()
+    if processing_thread is not None:
+        processing_thread.join(timeout=5)
+    event_log.close()
+
+atexit.register(shutdown)
+
 # 主程式開始
 if not connect_camera():
     sys.exit(1)
@@ -372,6 +402,7 @@ print("按 'x' 開關辨識功能 (完全關閉/開啟辨識)")
 print("按 '+' 增加偵測靈敏度")
 print("按 '-' 減少偵測靈敏度")
 print("按 'r' 重置人數計數")
+print("按 's' 顯示偵測紀錄統計")
 print("按 'e' 減少曝光度（使畫面變暗）")
 print("按 'E' 增加曝光度（使畫面變亮）")
 print("按 'q' 離開程式")
@@ -492,6 +523,12 @@ while True:
         person_count = 0
         print("Person count reset")
     
+    # 按s顯示最近一小時的偵測紀錄統計
+    elif k & 0xFF == ord('s'):
+        for camera, stats in event_log.aggregate(start=time.time() - summary_window).items():
+            print(f"{camera}: {stats['frames']} frames, {stats['detections']} detections, "
+                  f"avg process time {stats['mean_process_ms']:.1f} ms")
+    
     # 按q離開
     elif k & 0xFF == ord('q'):
         print("Program terminated")